@@ -3,17 +3,23 @@ Smart Expense Tracker with AI-Powered Insights
 NOW WITH: SQLite Database + Delete Functionality
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, g, jsonify, request
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from datetime import datetime, timedelta
 from collections import defaultdict
+import math
 import statistics
+import orjson
 
 # Import database functions
 from database import (
+    connect as db_connect,
     init_database,
     add_expense as db_add_expense,
+    add_expenses_bulk,
     get_all_expenses,
+    iter_expenses,
     get_expense_by_id,
     delete_expense as db_delete_expense,
     delete_all_expenses,
@@ -22,16 +28,55 @@ from database import (
     get_all_budgets,
     get_budget,
     get_total_spent,
+    get_expenses_summary,
+    get_overall_stats,
+    get_amount_stats,
+    get_recent_expenses_above,
     get_spending_by_category,
+    get_top_category,
+    get_spending_by_category_since,
     get_monthly_spending
 )
 
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson - much faster on large expense lists"""
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Skip the bytes -> str -> bytes round trip for API responses
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=self.option), mimetype='application/json'
+        )
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
 # Initialize database on startup
 init_database()
 
+@app.before_request
+def open_db_connection():
+    """Open one database connection shared by every helper in this request"""
+    g.db = db_connect()
+
+@app.teardown_request
+def close_db_connection(exception):
+    """Close the per-request database connection"""
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+# Most expenses /expenses returns in one page
+MAX_PAGE_SIZE = 1000
+
 # AI-like category keywords (simple but effective!)
 CATEGORY_KEYWORDS = {
     'food': ['restaurant', 'cafe', 'food', 'pizza', 'burger', 'lunch', 'dinner', 'breakfast', 'starbucks', 'mcdonalds', 'subway', 'kfc'],
@@ -80,44 +125,38 @@ def predict_next_month_spending():
 
 def detect_anomalies():
     """Detect unusual spending patterns"""
-    expenses = get_all_expenses()
+    stats = get_amount_stats()
     
-    if len(expenses) < 10:
+    if stats['count'] < 10 or stats['stdev'] == 0:
         return []
     
-    amounts = [exp['amount'] for exp in expenses]
-    mean = statistics.mean(amounts)
-    stdev = statistics.stdev(amounts) if len(amounts) > 1 else 0
+    mean = stats['mean']
+    threshold = mean + (2 * stats['stdev'])
     
     anomalies = []
-    for exp in expenses[:20]:  # Check last 20 transactions
-        if stdev > 0 and exp['amount'] > mean + (2 * stdev):
-            anomalies.append({
-                'expense': exp,
-                'reason': f"Unusually high amount (${exp['amount']:.2f} vs average ${mean:.2f})"
-            })
+    for exp in get_recent_expenses_above(threshold, limit=20):  # Check last 20 transactions
+        anomalies.append({
+            'expense': exp,
+            'reason': f"Unusually high amount (${exp['amount']:.2f} vs average ${mean:.2f})"
+        })
     
     return anomalies
 
 def generate_insights():
     """Generate smart insights from spending data"""
-    expenses = get_all_expenses()
+    stats = get_overall_stats()
     
-    if not expenses:
+    if not stats['count']:
         return []
     
     insights = []
     
-    # Category analysis
-    category_totals = get_spending_by_category()
-    total_spent = sum(cat['total'] for cat in category_totals.values())
-    
     # Find top spending category
-    if category_totals:
-        top_category = max(category_totals.items(), key=lambda x: x[1]['total'])
-        top_name = top_category[0]
-        top_amount = top_category[1]['total']
-        top_percentage = (top_amount / total_spent) * 100
+    top_category = get_top_category()
+    if top_category:
+        top_name = top_category['category']
+        top_amount = top_category['total']
+        top_percentage = (top_amount / stats['total']) * 100
         
         insights.append({
             'type': 'category_insight',
@@ -126,10 +165,9 @@ def generate_insights():
         })
     
     # Recent spending trend
-    recent_expenses = [exp for exp in expenses if 
-                      datetime.fromisoformat(exp['date']) > datetime.now() - timedelta(days=7)]
-    if recent_expenses:
-        recent_total = sum(exp['amount'] for exp in recent_expenses)
+    week_ago = (datetime.now() - timedelta(days=7)).isoformat()
+    recent_total = get_total_spent(start_date=week_ago)
+    if recent_total:
         daily_avg = recent_total / 7
         
         insights.append({
@@ -139,9 +177,8 @@ def generate_insights():
         })
     
     # Savings suggestion
-    if len(expenses) > 5:
-        avg_expense = statistics.mean([exp['amount'] for exp in expenses])
-        savings_potential = avg_expense * 0.1 * 30
+    if stats['count'] > 5:
+        savings_potential = stats['average'] * 0.1 * 30
         
         insights.append({
             'type': 'savings',
@@ -175,7 +212,8 @@ def home():
         ],
         'endpoints': {
             'POST /expense': 'Add new expense',
-            'GET /expenses': 'Get all expenses',
+            'POST /expenses/bulk': 'Add many expenses at once',
+            'GET /expenses': 'Get expenses (paginated with limit/offset)',
             'GET /expense/<id>': 'Get specific expense',
             'DELETE /expense/<id>': 'Delete specific expense',
             'DELETE /expenses/all': 'Delete ALL expenses',
@@ -232,25 +270,85 @@ def add_expense():
         'budget_alert': budget_alert
     }), 201
 
+@app.route('/expenses/bulk', methods=['POST'])
+def add_expenses_in_bulk():
+    """Add a list of expenses in a single transaction"""
+    data = request.get_json()
+    
+    if not isinstance(data, list) or not data:
+        return jsonify({'error': 'A non-empty list of expenses is required'}), 400
+    
+    rows = []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict) or 'amount' not in item or 'description' not in item:
+            return jsonify({'error': f'Expense {index}: amount and description are required'}), 400
+        
+        try:
+            amount = float(item['amount'])
+        except (TypeError, ValueError):
+            return jsonify({'error': f'Expense {index}: invalid amount format'}), 400
+        if not math.isfinite(amount) or amount <= 0:
+            return jsonify({'error': f'Expense {index}: amount must be a positive number'}), 400
+        
+        description = item['description']
+        if not isinstance(description, str):
+            return jsonify({'error': f'Expense {index}: description must be a string'}), 400
+        
+        for field in ('category', 'notes'):
+            if not isinstance(item.get(field), (str, type(None))):
+                return jsonify({'error': f'Expense {index}: {field} must be a string'}), 400
+        
+        # Stored dates must be ISO 8601 - monthly totals and date windows compare them as strings
+        date = item.get('date')
+        if date is not None:
+            try:
+                date = datetime.fromisoformat(date).isoformat()
+            except (TypeError, ValueError):
+                return jsonify({'error': f'Expense {index}: date must be ISO 8601 (e.g. 2025-11-01T10:00:00)'}), 400
+        
+        category = item.get('category') or smart_categorize(description)
+        rows.append((amount, description, category, date, item.get('notes') or ''))
+    
+    inserted = add_expenses_bulk(rows)
+    
+    return jsonify({
+        'success': True,
+        'inserted_count': inserted
+    }), 201
+
 @app.route('/expenses', methods=['GET'])
 def get_expenses():
-    """Get all expenses with optional filters"""
+    """Get expenses with optional filters, newest first, one page at a time"""
     category = request.args.get('category')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    try:
+        limit = int(request.args.get('limit', MAX_PAGE_SIZE))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    
+    if limit <= 0 or offset < 0:
+        return jsonify({'error': 'limit must be positive and offset non-negative'}), 400
+    limit = min(limit, MAX_PAGE_SIZE)
     
-    expenses = get_all_expenses(category, start_date, end_date)
+    expenses = get_all_expenses(category, start_date, end_date, limit, offset)
     
-    # Calculate summary
-    total = sum(exp['amount'] for exp in expenses)
+    # Summary covers every matching expense, not just this page
+    summary = get_expenses_summary(category, start_date, end_date)
     by_category = get_spending_by_category()
     
     return jsonify({
         'expenses': expenses,
         'summary': {
-            'total': round(total, 2),
-            'count': len(expenses),
+            'total': round(summary['total'], 2),
+            'count': summary['count'],
             'by_category': by_category
+        },
+        'pagination': {
+            'limit': limit,
+            'offset': offset,
+            'returned': len(expenses)
         }
     })
 
@@ -292,23 +390,25 @@ def delete_all():
 @app.route('/analytics', methods=['GET'])
 def get_analytics():
     """Get comprehensive spending analytics"""
-    expenses = get_all_expenses()
+    stats = get_overall_stats()
     
-    if not expenses:
+    if not stats['count']:
         return jsonify({'message': 'No expenses yet'})
     
-    total_spent = sum(exp['amount'] for exp in expenses)
-    avg_expense = total_spent / len(expenses)
+    total_spent = stats['total']
+    avg_expense = stats['average']
     
     # Category breakdown
     by_category_raw = get_spending_by_category()
-    by_category = {}
-    for cat, data in by_category_raw.items():
-        by_category[cat] = {
+    inv_pct = 100.0 / total_spent if total_spent else 0.0
+    by_category = {
+        cat: {
             'total': round(data['total'], 2),
             'count': data['count'],
-            'percentage': round((data['total'] / total_spent) * 100, 1)
+            'percentage': round(data['total'] * inv_pct, 1)
         }
+        for cat, data in by_category_raw.items()
+    }
     
     # Monthly trend
     by_month = get_monthly_spending()
@@ -321,7 +421,7 @@ def get_analytics():
     return jsonify({
         'overall': {
             'total_spent': round(total_spent, 2),
-            'total_transactions': len(expenses),
+            'total_transactions': stats['count'],
             'average_expense': round(avg_expense, 2),
             'last_30_days': round(recent_total, 2)
         },
@@ -349,9 +449,10 @@ def predict_spending():
     
     # Per category predictions
     category_spending = get_spending_by_category()
+    n_months = max(len(get_monthly_spending()), 1)
     category_predictions = {}
     for category, data in category_spending.items():
-        category_predictions[category] = round(data['total'] / max(len(get_monthly_spending()), 1), 2)
+        category_predictions[category] = round(data['total'] / n_months, 2)
     
     confidence = 'high' if expense_count > 30 else 'medium' if expense_count > 10 else 'low'
     
@@ -395,9 +496,11 @@ def get_budget_status():
     current_month = datetime.now().strftime('%Y-%m')
     current_month_start = current_month + '-01'
     
+    spent_by_category = get_spending_by_category_since(current_month_start)
+    
     status = {}
     for category, budget in budgets.items():
-        spent = get_total_spent(category=category, start_date=current_month_start)
+        spent = spent_by_category.get(category, 0.0)
         percentage = (spent / budget) * 100 if budget > 0 else 0
         remaining = budget - spent
         
@@ -416,16 +519,21 @@ def get_budget_status():
 
 @app.route('/export', methods=['GET'])
 def export_data():
-    """Export all data"""
-    expenses = get_all_expenses()
+    """Export all data - streamed so the expense list is never held in memory"""
     budgets = get_all_budgets()
-    
-    return jsonify({
-        'expenses': expenses,
-        'budgets': budgets,
-        'total_expenses': len(expenses),
-        'exported_at': datetime.now().isoformat()
-    })
+    exported_at = datetime.now().isoformat()
+    
+    def generate():
+        yield b'{"expenses":['
+        count = 0
+        for expense in iter_expenses():
+            yield (b',' if count else b'') + orjson.dumps(expense)
+            count += 1
+        yield b'],"budgets":' + orjson.dumps(budgets, option=ORJSONProvider.option)
+        yield b',"total_expenses":' + orjson.dumps(count)
+        yield b',"exported_at":' + orjson.dumps(exported_at) + b'}'
+    
+    return app.response_class(generate(), mimetype='application/json')
 
 @app.route('/stats', methods=['GET'])
 def get_stats():
@@ -445,4 +553,5 @@ if __name__ == '__main__':
     print("📊 AI-Powered Analytics & Predictions Active")
     print("🗑️  Delete Functions Enabled")
     print("🚀 Server running on http://localhost:5000")
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # Development server only - use gunicorn in production (see gunicorn_conf.py)
+    app.run(port=5000)
\ No newline at end of file
@@ -3,17 +3,77 @@ Database Helper for Smart Expense Tracker
 Simple SQLite database operations - no flaws, perfect persistence
 """
 
+import math
+import os
 import sqlite3
 from datetime import datetime
 from contextlib import contextmanager
+from functools import lru_cache, wraps
+from flask import g, has_request_context
 
 DATABASE_NAME = 'expenses.db'
 
-@contextmanager
-def get_db_connection():
-    """Context manager for database connections - automatic cleanup!"""
+# Dedicated connection per process used only to watch for writes
+_watch_conn = None
+_watch_pid = None
+
+def _db_version():
+    """Changes after any commit to the database - from any connection or worker process
+    
+    data_version is only comparable on the connection that read it, and a
+    forked worker opens its own watch connection, so the pid is part of the
+    key - entries cached before a fork never match in the child.
+    """
+    global _watch_conn, _watch_pid
+    pid = os.getpid()
+    if _watch_conn is None or _watch_pid != pid:
+        _watch_conn = sqlite3.connect(DATABASE_NAME, check_same_thread=False)
+        _watch_pid = pid
+    return pid, _watch_conn.execute('PRAGMA data_version').fetchone()[0]
+
+def cached_until_write(func):
+    """Memoize an aggregate until the next write to the database
+    
+    Callers share the cached result, so treat it as read-only.
+    """
+    @lru_cache(maxsize=8)
+    def cached(version, *args):
+        return func(*args)
+    
+    @wraps(func)
+    def wrapper(*args):
+        return cached(_db_version(), *args)
+    
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
+def connect():
+    """Open a new database connection"""
     conn = sqlite3.connect(DATABASE_NAME)
     conn.row_factory = sqlite3.Row  # Access columns by name
+    
+    # Per-connection tuning - safe with WAL, keeps temp data and hot pages in RAM
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')  # 64MB
+    conn.execute('PRAGMA mmap_size=268435456')  # 256MB
+    return conn
+
+def _request_connection():
+    """Connection cached on flask.g for the current request, if any"""
+    if has_request_context():
+        return g.get('db')
+    return None
+
+@contextmanager
+def get_db_connection():
+    """Context manager for database connections - automatic cleanup!
+    
+    Inside a Flask request the per-request connection is reused, so one
+    request opens the database once no matter how many helpers it calls.
+    """
+    shared = _request_connection()
+    conn = shared or connect()
     try:
         yield conn
         conn.commit()
@@ -21,13 +81,17 @@ def get_db_connection():
         conn.rollback()
         raise e
     finally:
-        conn.close()
+        if shared is None:
+            conn.close()
 
 def init_database():
     """Initialize database with tables - run once on startup"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
+        # WAL lets readers run alongside writers; persists in the db file
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Create expenses table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS expenses (
@@ -51,14 +115,29 @@ def init_database():
         ''')
         
         # Create indexes for faster queries
+        # (category, date) also serves category-only lookups via its prefix
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_category 
-            ON expenses(category)
+            CREATE INDEX IF NOT EXISTS idx_cat_date 
+            ON expenses(category, date)
         ''')
         
+        cursor.execute('DROP INDEX IF EXISTS idx_category')
+        
+        # Leads with date for range scans and ORDER BY date; category and
+        # amount ride along so per-category totals over a date window (budget
+        # status) are read from the index alone, whether or not ANALYZE has run
         cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_date 
-            ON expenses(date)
+            CREATE INDEX IF NOT EXISTS idx_date_cat_amount 
+            ON expenses(date, category, amount)
+        ''')
+        
+        cursor.execute('DROP INDEX IF EXISTS idx_date')
+        
+        # Month prefix of the ISO date plus amount - monthly totals come
+        # straight from this index, already grouped and sorted
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_month 
+            ON expenses(substr(date, 1, 7), amount)
         ''')
         
         print("✅ Database initialized successfully!")
@@ -87,32 +166,85 @@ def add_expense(amount, description, category, date=None, notes=''):
         
         return dict(row)
 
-def get_all_expenses(category=None, start_date=None, end_date=None):
-    """Get all expenses with optional filters"""
+def add_expenses_bulk(expenses):
+    """Add many expenses in one transaction - RETURNS NUMBER INSERTED
+    
+    Each item is an (amount, description, category, date, notes) tuple;
+    a date of None means now.
+    """
+    now = datetime.now().isoformat()
+    rows = [(amount, description, category, date or now, notes, now)
+            for amount, description, category, date, notes in expenses]
+    
     with get_db_connection() as conn:
         cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO expenses (amount, description, category, date, notes, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        return cursor.rowcount
+
+def _expense_filters(category=None, start_date=None, end_date=None):
+    """Build the WHERE clause shared by the expense queries"""
+    where = ' WHERE 1=1'
+    params = []
+    
+    if category:
+        where += ' AND category = ?'
+        params.append(category)
+    
+    if start_date:
+        where += ' AND date >= ?'
+        params.append(start_date)
+    
+    if end_date:
+        where += ' AND date <= ?'
+        params.append(end_date)
+    
+    return where, params
+
+def _expenses_query(category=None, start_date=None, end_date=None, limit=None, offset=0):
+    """Build the filtered expenses query and its parameters
+    
+    ORDER BY date DESC walks idx_date_cat_amount (or idx_cat_date) backwards, so a
+    LIMIT only reads that many index entries.
+    """
+    where, params = _expense_filters(category, start_date, end_date)
+    query = 'SELECT * FROM expenses' + where + ' ORDER BY date DESC'
+    
+    if limit is not None:
+        query += ' LIMIT ? OFFSET ?'
+        params += [limit, offset]
+    
+    return query, params
+
+def _plain_cursor(conn):
+    """Cursor returning raw tuples - cheaper than sqlite3.Row for big result sets"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    return cursor
+
+def _rows_as_dicts(cursor):
+    """Yield each row as a dict built straight from its tuple"""
+    columns = [col[0] for col in cursor.description]
+    for row in cursor:
+        yield dict(zip(columns, row))
+
+def get_all_expenses(category=None, start_date=None, end_date=None, limit=None, offset=0):
+    """Get all expenses with optional filters and pagination"""
+    with get_db_connection() as conn:
+        cursor = _plain_cursor(conn)
+        cursor.execute(*_expenses_query(category, start_date, end_date, limit, offset))
         
-        query = 'SELECT * FROM expenses WHERE 1=1'
-        params = []
-        
-        if category:
-            query += ' AND category = ?'
-            params.append(category)
-        
-        if start_date:
-            query += ' AND date >= ?'
-            params.append(start_date)
-        
-        if end_date:
-            query += ' AND date <= ?'
-            params.append(end_date)
-        
-        query += ' ORDER BY date DESC'
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+        return list(_rows_as_dicts(cursor))
+
+def iter_expenses(category=None, start_date=None, end_date=None):
+    """Yield expenses one at a time without loading them all into memory"""
+    with get_db_connection() as conn:
+        cursor = _plain_cursor(conn)
+        cursor.execute(*_expenses_query(category, start_date, end_date))
         
-        return [dict(row) for row in rows]
+        yield from _rows_as_dicts(cursor)
 
 def get_expense_by_id(expense_id):
     """Get a specific expense by ID"""
@@ -146,6 +278,7 @@ def delete_all_expenses():
         
         return deleted_count
 
+@cached_until_write
 def get_expense_count():
     """Get total number of expenses"""
     with get_db_connection() as conn:
@@ -209,29 +342,86 @@ def delete_all_budgets():
 
 def get_total_spent(category=None, start_date=None, end_date=None):
     """Get total amount spent with optional filters"""
+    if not (category or start_date or end_date):
+        return _get_grand_total()
+    return _query_total_spent(category, start_date, end_date)
+
+@cached_until_write
+def _get_grand_total():
+    """Unfiltered total - polled by the dashboard, so cached until the next write"""
+    return _query_total_spent()
+
+def _query_total_spent(category=None, start_date=None, end_date=None):
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
-        query = 'SELECT SUM(amount) as total FROM expenses WHERE 1=1'
-        params = []
+        where, params = _expense_filters(category, start_date, end_date)
+        cursor.execute('SELECT SUM(amount) as total FROM expenses' + where, params)
+        result = cursor.fetchone()
+        
+        return result['total'] or 0.0
+
+def get_expenses_summary(category=None, start_date=None, end_date=None):
+    """Get count and total of expenses matching the filters"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
         
-        if category:
-            query += ' AND category = ?'
-            params.append(category)
+        where, params = _expense_filters(category, start_date, end_date)
+        cursor.execute(
+            'SELECT COUNT(*) as count, COALESCE(SUM(amount), 0) as total FROM expenses' + where,
+            params
+        )
+        row = cursor.fetchone()
         
-        if start_date:
-            query += ' AND date >= ?'
-            params.append(start_date)
+        return dict(row)
+
+def get_overall_stats():
+    """Get count, total and average of all expenses in a single scan"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) as count,
+                   COALESCE(SUM(amount), 0) as total,
+                   COALESCE(AVG(amount), 0) as average
+            FROM expenses
+        ''')
+        row = cursor.fetchone()
         
-        if end_date:
-            query += ' AND date <= ?'
-            params.append(end_date)
+        return dict(row)
+
+def get_amount_stats():
+    """Get count, mean and sample standard deviation of expense amounts"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) as count,
+                   AVG(amount) as mean,
+                   SUM((amount - (SELECT AVG(amount) FROM expenses)) *
+                       (amount - (SELECT AVG(amount) FROM expenses))) as sum_sq
+            FROM expenses
+        ''')
+        row = cursor.fetchone()
         
-        cursor.execute(query, params)
-        result = cursor.fetchone()
+        count = row['count']
+        stdev = math.sqrt(row['sum_sq'] / (count - 1)) if count > 1 else 0.0
+        return {'count': count, 'mean': row['mean'] or 0.0, 'stdev': stdev}
+
+def get_recent_expenses_above(threshold, limit=20):
+    """Get expenses above threshold among the most recent `limit` expenses"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM (
+                SELECT * FROM expenses ORDER BY date DESC LIMIT ?
+            )
+            WHERE amount > ?
+            ORDER BY date DESC
+        ''', (limit, threshold))
+        rows = cursor.fetchall()
         
-        return result['total'] or 0.0
+        return [dict(row) for row in rows]
 
+@cached_until_write
 def get_spending_by_category():
     """Get spending grouped by category"""
     with get_db_connection() as conn:
@@ -251,15 +441,52 @@ def get_spending_by_category():
             'count': row['count']
         } for row in rows}
 
+@cached_until_write
+def get_top_category():
+    """Get the category with the highest total spending, or None"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT category,
+                   SUM(amount) as total,
+                   COUNT(*) as count
+            FROM expenses
+            GROUP BY category
+            ORDER BY total DESC
+            LIMIT 1
+        ''')
+        row = cursor.fetchone()
+        
+        if row:
+            return dict(row)
+        return None
+
+def get_spending_by_category_since(start_date):
+    """Get total spent per category from start_date onwards"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        # Pin the date range scan - without ANALYZE stats SQLite prefers
+        # walking all of idx_cat_date to avoid sorting for the GROUP BY
+        cursor.execute('''
+            SELECT category, SUM(amount) as total
+            FROM expenses INDEXED BY idx_date_cat_amount
+            WHERE date >= ?
+            GROUP BY category
+        ''', (start_date,))
+        rows = cursor.fetchall()
+        
+        return {row['category']: row['total'] for row in rows}
+
+@cached_until_write
 def get_monthly_spending():
     """Get spending grouped by month"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT strftime('%Y-%m', date) as month,
+            SELECT substr(date, 1, 7) as month,
                    SUM(amount) as total
             FROM expenses
-            GROUP BY month
+            GROUP BY substr(date, 1, 7)
             ORDER BY month DESC
         ''')
         rows = cursor.fetchall()
@@ -0,0 +1,15 @@
+"""
+Gunicorn config for Smart Expense Tracker
+Run with: gunicorn -c gunicorn_conf.py app:app
+"""
+
+import multiprocessing
+
+bind = '0.0.0.0:5000'
+
+# Several workers serve requests in parallel; WAL mode lets them read while another writes
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_class = 'gevent'
+
+# Import app.py (and run init_database) once in the master before forking workers
+preload_app = True